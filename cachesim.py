@@ -43,31 +43,48 @@ plt.interactive(False)                      # Some changes to plotting so we can
 # import sys                                # For exiting to system as needed (depreciated, we now use command
                                             # -line args)
 import subprocess                           # For calling other files
+import os                                   # For checking the saved (parsed) copies of trace files
+import mmap                                 # For reading trace files straight from memory
+import tempfile                             # For saving the parsed copies of trace files safely
+import zipfile                              # (saved copies are .npz files, i.e. zip archives)
 import time                                 # For the runtime (so we know we aren't hanging)
+from multiprocessing import Pool, cpu_count # For running the configurations in parallel
+from collections import OrderedDict         # For the LRU order of fully associative caches
+try:
+    from numba import njit                  # JIT compiler for the simulation kernel (optional, but MUCH faster)
+except ImportError:
+    # Without numba the kernel just runs as plain Python (same results, just slow)
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
 
 """ Class Definitions -------------------------------------------------------------------------------------------
-# - There are several classes that we can use to model the simulation in this project, and to effectively
-#   document the datastructure (standard Python list of lists), we will cover them here.
+# - The cache is modeled by a single class, and to effectively document the datastructure (parallel numpy arrays
+#   of shape (num_sets, num_ways), one per field of a block, or an ordered dict of blocks for fully associative
+#   caches), we will cover it here.
 # - Basic initializations will be covered in the class members, with the default being lowest-indexed structs
 #   as given in the project specification
 """
 
-class Block:
-    # Explicit typecasting here since Python is a funny language
-    def __init__(self, size):
-        self.size = size
-        self.valid = bool(False)            # Dirty/clean bits here
-        self.dirty = bool(False)            # Determines if we've done "dirty" store operations
-        self.tag = int(0)                   # Tagging here
-        self.data = [0] * size                    # Data (initialize as nothing)
-        self.last_used = int(0)             # LRU tracking here
+# Labels used in the result files, indexed by Cache.PlacementType and Cache.WritePolicy respectively
+_PLACEMENT_STR = ("DM", "2W", "4W", "FA")
+_WRITE_POLICY_STR = ("WB", "WT")
 
-class Set:
-    def __init__(self, num_ways, block_size):
-        self.lines = [Block(block_size) for _ in range(num_ways)]
+# Record layout of one result (same fields/order as a line of a result file), used for the binary copy of the results
+RESULT_DTYPE = np.dtype([('cache_size', 'i8'), ('block_size', 'i8'), ('placement', 'U4'), ('ways', 'i8'),
+                         ('write_policy', 'U4'), ('requests', 'i8'), ('hits', 'i8'), ('hit_rate', 'f8'),
+                         ('bytes_to_cache', 'i8'), ('bytes_to_memory', 'i8')])
 
 # Define the main cache class that we want to emulate
 class Cache:
+    # Fixed set of attributes, so instances don't carry a __dict__ and attribute reads in the per-access path are
+    # slot lookups instead of dict lookups
+    __slots__ = ('cache_size', 'block_size', 'placement_type', 'write_policy', 'num_ways', 'num_sets', 'num_blocks',
+                 'offset_bits', 'set_bits', 'tag_shift', 'offset_mask', 'set_mask', 'valid', 'dirty', 'tag', 'lru',
+                 'cache_dict',
+                 'total_requests', 'total_hits', 'bytes_to_cache', 'bytes_to_memory', 'access_count')
+
     # Define the placement type here
     class PlacementType:
         Direct_Mapped = 0                   # Direct-mapped
@@ -79,6 +96,11 @@ class Cache:
         WB = 0                              # Write-back
         WT = 1                              # Write-through 
 
+    # Operation codes used for the trace arrays
+    class Operation:
+        Read = 0                            # Read/load
+        Write = 1                           # Write/store
+
     """ Main initialization function based on parameters passed in during simulation"""
     # Default to the basic (aka block size 0, this is overwritten in the test cases we write below)
     def __init__(self, cache_size, block_size, write_policy, placement_type):
@@ -120,14 +142,27 @@ class Cache:
         # bit, and blocks of data
         self.num_blocks = self.cache_size // self.block_size
         self.num_sets = self.num_blocks // self.num_ways
-        self.offset_bits = int(np.log2(self.block_size))
-        self.set_bits = 0 if self.placement_type == self.PlacementType.Fully_Associative else int(np.log2(self.num_sets))
+        # Sizes are powers of two, so log2 is exactly the bit length of (size - 1) (integer math, no float log)
+        self.offset_bits = (self.block_size - 1).bit_length()
+        self.set_bits = 0 if self.placement_type == self.PlacementType.Fully_Associative else (self.num_sets - 1).bit_length()
         self.tag_shift = self.offset_bits + self.set_bits
+        self.offset_mask = self.block_size - 1                  # Masks are computed once here instead of per access
+        self.set_mask = (1 << self.set_bits) - 1                # (0 for fully-associative, so the index is always 0)
 
-        # Data structure is a list of Sets, configured based on the number of ways to arrange the sets, and
-        # the number of sets (calculated above)
-        # Initialize the sets: list of sets, each set is a list of blocks (ways)
-        self.sets = [Set(self.num_ways, block_size) for _ in range(self.num_sets)]
+        # Data structure is a set of parallel arrays (one per field of a block), configured based on the number
+        # of ways to arrange the sets, and the number of sets (calculated above). Row = set, column = way.
+        # There is no data array since the simulator never reads/writes the block contents
+        # A fully associative cache can have thousands of ways, so instead of scanning all of them on every access
+        # it keeps an ordered dict of tag -> dirty bit, least recently used first (O(1) lookups and LRU updates)
+        if placement_type == self.PlacementType.Fully_Associative:
+            self.cache_dict = OrderedDict()
+            self.valid = self.dirty = self.tag = self.lru = None
+        else:
+            self.cache_dict = None
+            self.valid = np.zeros((self.num_sets, self.num_ways), dtype=bool)        # Valid bits
+            self.dirty = np.zeros((self.num_sets, self.num_ways), dtype=bool)        # "Dirty" store operations
+            self.tag = np.zeros((self.num_sets, self.num_ways), dtype=np.int64)      # Tagging here
+            self.lru = np.zeros((self.num_sets, self.num_ways), dtype=np.int64)      # LRU tracking here
         
         # Statistics:
         # These will be changed later to reflect the data that we need to report, in essence this is just a stat
@@ -155,39 +190,58 @@ class Cache:
         return address >> self.tag_shift
 
     def get_block_index(self, address):
-        # Fully associative caches have no set index
-        if self.placement_type == self.PlacementType.Fully_Associative:
-            return 0
-        return (address >> self.offset_bits) & ((1 << self.set_bits) - 1)
+        # Fully associative caches have no set index (set_mask is 0)
+        return (address >> self.offset_bits) & self.set_mask
     
     def get_block_offset(self, address):
         # Extract block offset from address
-        return int(address & self.block_size - 1)
+        return address & self.offset_mask
 
-    """Read and Write functions: these iterate over all the cache to find if a hit exists, then does specific
-    actions for each..."""
-    # Read is a complex function that checks if we have a hit in memory, and that the block we're trying to 
-    # read is valid or not, and then acts based on that (if we need to access main memory or we can stay in cache)
+    """Read and Write functions: these check the set to find if a hit exists, then do specific actions for each.
+    Both are the same access (lookup, then LRU replacement on a miss), so they share _access and only differ in the
+    is_write flag"""
+    # Read checks if we have a hit in memory, and that the block we're trying to read is valid or not, and then
+    # acts based on that (if we need to access main memory or we can stay in cache)
     def read(self, address):
+        return self._access(address, False)
+
+    # Write checks if we have a hit and then determines where it needs to grab the value from
+    def write(self, address):
+        return self._access(address, True)
+
+    def _access(self, address, is_write):
         self.total_requests += 1                                # Data collection for hitrate
         set_index = self.get_block_index(address)               # Grab index
         tag = self.get_tag(address)                             # Grab the tag (comparison)
-        hit = False                                             # Initialize hit flag
-        replace_index = None                                    # Initialize replace_index for printing
+        write_back = self.write_policy == self.WritePolicy.WB
+        self.access_count += 1
         
-        # Check if we have a hit
-        set = self.sets[set_index]                              # Since we have to check if we actually
-        for i, block in enumerate(set.lines):
-            if block.valid and block.tag == tag:                # have a hit, we just iterate over all
-                # Cache hit                                     # Values in the cache (kinda slow)
-                self.total_hits += 1
-                self.access_count += 1
-                block.last_used = self.access_count
-                hit = True
-                # print(f"Accessing address: {address:#010x}")
-                # print(f"Set Index: {set_index}, Tag: {tag}")
-                # print(f"Hit: {hit}, Evicted Block: {replace_index if not hit else 'None'}")
-                return True
+        if self.cache_dict is not None:
+            return self._access_fully_associative(tag, is_write, write_back)
+        
+        # Grab the rows of the set once (views into the cache arrays), so the rest of the access just indexes
+        # them by way instead of going back through self.<array>[set_index, way] every time
+        valid = self.valid[set_index]
+        dirty = self.dirty[set_index]
+        lru = self.lru[set_index]
+        tags = self.tag[set_index]
+        
+        # Check if we have a hit, comparing the tag against every way of the set at once
+        ways = np.flatnonzero(valid & (tags == tag))
+        if ways.size:
+            # Cache hit
+            way = ways[0]
+            self.total_hits += 1
+            lru[way] = self.access_count
+            
+            if is_write:
+                if write_back:
+                    # In write-back, just mark as dirty
+                    dirty[way] = True
+                else:  # Write-through
+                    # Write to memory immediately
+                    self.bytes_to_memory += 4
+            return True
         
         # If we can't find the value in the cache, we have a miss (SLOW)
         # Cache miss: need to load from memory
@@ -197,98 +251,66 @@ class Cache:
                                                                 # a miss causes all values of the read
                                                                 # to have to come from main memory
         
-        # Find block to replace (LRU)
+        # Find block to replace (LRU, not random since that would be fun-er)
         replace_index = self.find_lru_block(set_index)
         
         # If dirty block is being replaced in write-back mode, write it to memory
-        if self.write_policy == self.WritePolicy.WB and self.sets[set_index].lines[replace_index].valid and self.sets[set_index].lines[replace_index].dirty:
+        if write_back and valid[replace_index] and dirty[replace_index]:
             self.bytes_to_memory += self.block_size
         
-        # Update block values
-        self.sets[set_index].lines[replace_index].valid = True
-        self.sets[set_index].lines[replace_index].dirty = False
-        self.sets[set_index].lines[replace_index].tag = tag
-        self.access_count += 1
-        self.sets[set_index].lines[replace_index].last_used = self.access_count
+        # Update block values (don't actually store anything here)
+        valid[replace_index] = True
+        tags[replace_index] = tag
+        lru[replace_index] = self.access_count
+        
+        # A write miss leaves the block dirty in write-back mode, in write-through it goes to memory immediately
+        # (we can only write 4 bytes at a time) and can't be dirty since it wasn't written
+        dirty[replace_index] = is_write and write_back
+        if is_write and not write_back:
+            self.bytes_to_memory += 4
         
-        # print(f"Accessing address: {address:#010x}")
-        # print(f"Set Index: {set_index}, Tag: {tag}")
-        # print(f"Hit: {hit}, Evicted Block: {replace_index if not hit else 'None'}")
-
         # If we have a miss, return false :( (this is defined as "expensive" - Dr. Ransbottom)
         return False
-
-    # Write checks if we have a hit and then determines where it needs to grab the value from
-    def write(self, address):
-        self.total_requests += 1                                            # Data collection
-        set_index = self.get_block_index(address)                           # Grab index (iteration)
-        tag = self.get_tag(address)                                         # Grab the tag (comparison)
-        
-        # Check if we have a hit, then we can write
-        hit = False                                                     # By default, hit is false (assume good)
-        set = self.sets[set_index]                                      # Since we have to check if we actually
-        for block in set.lines:
-            if block.valid and block.tag == tag:
-                # Cache hit
-                self.total_hits += 1
-                hit = True
-                self.access_count += 1
-                block.last_used = self.access_count
-                
-                if self.write_policy == self.WritePolicy.WB:
-                    # In write-back, just mark as dirty
-                    block.dirty = True
-                else:  # Write-through
-                    # Write to memory immediately
-                    self.bytes_to_memory += 4
-                
-                break   # Go to writing the value in the cache (we don't actually need to grab/use it, so just)
-                        # mark as a hit and add the bits if not (aka we mark as dirty and continue)
-        
-        # We have a miss, and we need to grab the address to write from in memory (SLOW)
-        if not hit:
-            # Cache miss - need to load from memory
-            self.bytes_to_cache += self.block_size
             
-            # Method to replace the block, LRU, not random since that would be fun-er
-            replace_index = self.find_lru_block(set_index)
-            
-            # If dirty block is being replaced in write-back mode, write it to memory
-            if self.write_policy == self.WritePolicy.WB and self.sets[set_index].lines[replace_index].valid and self.sets[set_index].lines[replace_index].dirty:
-                self.bytes_to_memory += self.block_size
-            
-            # Update block contents as valid (don't actually store anything here)
-            self.sets[set_index].lines[replace_index].valid = True
-            self.sets[set_index].lines[replace_index].tag = tag
-            self.access_count += 1
-            self.sets[set_index].lines[replace_index].last_used = self.access_count
-            
-            if self.write_policy == self.WritePolicy.WB:
-                # Mark as dirty in write-back mode
-                self.sets[set_index].lines[replace_index].dirty = True    # Need to clear it (not covered)
-            else:  # Write-through
-                # Write to memory immediately
-                self.bytes_to_memory += 4                                 # We can only write 4 bytes at a time
-                self.sets[set_index].lines[replace_index].dirty = False   # Can't be dirty if it wasn't written
+    # Same access as above for a fully associative cache, on the ordered dict (the end of it is the most recently
+    # used block, so the front is always the block to replace)
+    def _access_fully_associative(self, tag, is_write, write_back):
+        blocks = self.cache_dict
+        if tag in blocks:
+            # Cache hit
+            blocks.move_to_end(tag)
+            self.total_hits += 1
+            if is_write:
+                if write_back:
+                    blocks[tag] = True                          # In write-back, just mark as dirty
+                else:
+                    self.bytes_to_memory += 4                   # Write-through goes to memory now
+            return True
         
-        return hit
-            
-    """A basic function to determine the last/least used block to replace"""
-    def find_lru_block(self, set_index):
-        # Find least recently used block in the set
-        min_used = float('inf')
-        min_index = 0
+        # Cache miss: load from memory, and if the cache is full replace the LRU block
+        self.bytes_to_cache += self.block_size
+        if len(blocks) >= self.num_ways:
+            _, evicted_dirty = blocks.popitem(last=False)
+            if write_back and evicted_dirty:
+                self.bytes_to_memory += self.block_size         # Dirty block written back to memory
         
-        for i, block in enumerate(self.sets[set_index].lines):
-            if not block.valid:
-                # If we find an invalid block, use it immediately :)
-                return i
+        blocks[tag] = is_write and write_back
+        if is_write and not write_back:
+            self.bytes_to_memory += 4                           # We can only write 4 bytes at a time
+        return False
             
-            if block.last_used < min_used:      # Keep iterating until we find the right one
-                min_used = block.last_used
-                min_index = i
+    """A basic function to determine the last/least used block to replace (not used for fully associative caches,
+    the ordered dict keeps the LRU block at its front)"""
+    def find_lru_block(self, set_index):
+        # A fully associative cache has no ways/LRU counts to pick from, so say so instead of failing on lru = None
+        if self.cache_dict is not None:
+            raise RuntimeError("find_lru_block is not used for fully associative caches, the least recently "
+                               "used block is the first entry of cache_dict")
         
-        return min_index                        # Returns the key (index) that we can use in the datastructure
+        # Every valid block has an access count of at least 1, and invalid blocks are left at 0, so a single
+        # argmin over the row picks the first invalid block if there is one (use it immediately :)), otherwise
+        # the least recently used block
+        return int(np.argmin(self.lru[set_index]))              # Returns the key (index) into the arrays
     
     """Some statistical functions for getting data for graphs, etc."""
     def get_hit_rate(self):
@@ -296,43 +318,487 @@ class Cache:
             return 0
         return float(self.total_hits / self.total_requests)
     
+    # The placement/write policy values are indexes into the label tuples (see above the class)
     def get_placement_str(self):
-        if self.placement_type == self.PlacementType.Direct_Mapped:
-            return "DM"
-        elif self.placement_type == self.PlacementType.Two_Way:
-            return "2W"
-        elif self.placement_type == self.PlacementType.Four_Way:
-            return "4W"
-        else:
-            return "FA"
+        return _PLACEMENT_STR[self.placement_type]
     
     def get_write_policy_str(self):
-        return "WB" if self.write_policy == self.WritePolicy.WB else "WT"
+        return _WRITE_POLICY_STR[self.write_policy]
     
     """This function was annoying to write but it just concatenates the results into a string for storage"""
     def get_result_str(self):
         # Format: cache_size block_size placement_type num_ways write_policy total_requests hits hit_rate bytes_to_cache bytes_to_memory
         # print(f"{self.cache_size} {self.block_size} {self.get_placement_str()} {self.num_ways} {self.get_write_policy_str()} {self.total_requests} {self.total_hits} {self.get_hit_rate():.2f} {self.bytes_to_cache} {self.bytes_to_memory}")
-        return f"{self.cache_size} {self.block_size} {self.get_placement_str()} {self.num_ways} {self.get_write_policy_str()} {self.total_requests} {self.total_hits} {self.get_hit_rate():.2f} {self.bytes_to_cache} {self.bytes_to_memory}"
+        return "%d %d %s %d %s %d %d %.2f %d %d" % (self.cache_size, self.block_size, self.get_placement_str(), self.num_ways,
+                                                    self.get_write_policy_str(), self.total_requests, self.total_hits,
+                                                    self.get_hit_rate(), self.bytes_to_cache, self.bytes_to_memory)
+    
+    # Same values as the result line, as a tuple for RESULT_DTYPE (hit rate rounded the same way as in the line)
+    def get_result_record(self):
+        return (self.cache_size, self.block_size, self.get_placement_str(), self.num_ways,
+                self.get_write_policy_str(), self.total_requests, self.total_hits,
+                round(self.get_hit_rate(), 2), self.bytes_to_cache, self.bytes_to_memory)
             
 """ Helper Functions --------------------------------------------------------------------------------------------
 , These are used in the actual simulation... see main for usage and/or the documentation"""
-def read_trace_file(filename):
-    operations = []                                                     # Store the operations
-    try:
-        with open(filename, 'r') as f:
-            for line in f:
-                parts = line.strip().split()
-                if len(parts) == 2:
-                    op_type = parts[0]                                  # "read" or "write"
-                    address = int(parts[1], 16)                         # Convert hex to int (should be done, but yk)
-                    operations.append((op_type, address))
-                    # print(op_type)
+# Returns the trace as two parallel arrays (op codes and addresses) instead of a list of tuples, so that the
+# simulation can decode every address at once with numpy rather than once per access per configuration
+# The file is memory-mapped and scanned byte by byte by the (compiled) parser below, a single pass over the file
+# with no Python string objects created per line
+
+# Whitespace bytes (space, \t, \n, \v, \f, \r) as used by str.split()
+@njit(cache=True)
+def _is_space(c):
+    return c == 32 or (9 <= c <= 13)
+
+# Parses the raw bytes of a trace file. Each line is "<operation> <hex address>" (the address may or may not have a
+# 0x prefix), lines that don't have exactly two fields or have an unknown operation are ignored
+# Lines end at "\n" or "\r" like Python's universal newlines (a "\r\n" just leaves an empty line in between, which is
+# skipped), and an address that doesn't fit in 64 bits is an error instead of silently wrapping around
+@njit(cache=True, boundscheck=False)
+def _parse_trace_bytes(buf):
+    n = buf.shape[0]
+    max_lines = 1
+    for i in range(n):
+        if buf[i] == 10 or buf[i] == 13:                                # "\n" or "\r"
+            max_lines += 1
+    ops = np.empty(max_lines, dtype=np.uint8)
+    addrs = np.empty(max_lines, dtype=np.uint64)
+    count = 0
 
+    i = 0
+    while i < n:
+        end = i
+        while end < n and buf[end] != 10 and buf[end] != 13:
+            end += 1
+
+        # Split the line into its first two fields
+        pos = i
+        while pos < end and _is_space(buf[pos]):
+            pos += 1
+        op_start = pos
+        while pos < end and not _is_space(buf[pos]):
+            pos += 1
+        op_end = pos
+        while pos < end and _is_space(buf[pos]):
+            pos += 1
+        addr_start = pos
+        while pos < end and not _is_space(buf[pos]):
+            pos += 1
+        addr_end = pos
+        while pos < end and _is_space(buf[pos]):
+            pos += 1
+        i = end + 1
+        if addr_start == addr_end or pos != end:                        # Need exactly two fields
+            continue
+
+        # Operation name, case insensitive (c | 32 lowercases a letter)
+        op = -1
+        if op_end - op_start == 4:
+            c0 = buf[op_start] | 32
+            c1 = buf[op_start + 1] | 32
+            c2 = buf[op_start + 2] | 32
+            c3 = buf[op_start + 3] | 32
+            if (c0 == 114 and c1 == 101 and c2 == 97 and c3 == 100) or \
+               (c0 == 108 and c1 == 111 and c2 == 97 and c3 == 100):     # "read" or "load"
+                op = 0                                                  # Cache.Operation.Read
+        elif op_end - op_start == 5:
+            c0 = buf[op_start] | 32
+            c1 = buf[op_start + 1] | 32
+            c2 = buf[op_start + 2] | 32
+            c3 = buf[op_start + 3] | 32
+            c4 = buf[op_start + 4] | 32
+            if (c0 == 119 and c1 == 114 and c2 == 105 and c3 == 116 and c4 == 101) or \
+               (c0 == 115 and c1 == 116 and c2 == 111 and c3 == 114 and c4 == 101):  # "write" or "store"
+                op = 1                                                  # Cache.Operation.Write
+        if op < 0:
+            continue                                                    # Unknown operations are ignored
+
+        # Address, hex digits accumulated 4 bits at a time
+        if addr_end - addr_start > 2 and buf[addr_start] == 48 and (buf[addr_start + 1] | 32) == 120:
+            addr_start += 2                                             # Skip the "0x"
+        addr = np.uint64(0)
+        for j in range(addr_start, addr_end):
+            c = buf[j]
+            if 48 <= c <= 57:                                           # 0-9
+                digit = c - 48
+            elif 97 <= (c | 32) <= 102:                                 # a-f (or A-F)
+                digit = (c | 32) - 87
+            else:
+                raise ValueError("Invalid hex address in trace file")
+            if addr >> np.uint64(60) != 0:                              # Top digit already used, no room left
+                raise ValueError("Hex address in trace file is larger than 64 bits")
+            addr = (addr << np.uint64(4)) | np.uint64(digit)
+
+        ops[count] = op
+        addrs[count] = addr
+        count += 1
+
+    return ops[:count].copy(), addrs[:count].copy()
+
+def _parse_trace(filename):
+    try:
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:                       # Can't mmap an empty file
+                return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint64)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
     except FileNotFoundError:
         print(f"Error: File '{filename}' not found.")
+        return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint64)
+    
+    # The map is unmapped once the last reference to it (the byte view) is gone, so it isn't closed explicitly
+    # (closing it while the view still exists, e.g. on a parse error, would raise)
+    # Returns the operations as arrays for the simulation kernel
+    return _parse_trace_bytes(np.frombuffer(mm, dtype=np.uint8))
+
+# The parsed arrays are saved next to the trace (TRACE_NAME.trace.npz), so following runs on the same trace just
+# load them back instead of parsing the text again. The copy is only used if it is newer than the trace file
+def read_trace_file(filename):
+    cache_path = filename + '.npz'
+    try:
+        if os.path.getmtime(cache_path) > os.path.getmtime(filename):
+            with np.load(cache_path) as data:
+                return data['ops'], data['addrs']
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        pass                                            # No saved copy yet, no trace file, or a broken copy
+    
+    ops, addrs = _parse_trace(filename)
+    if os.path.exists(filename):
+        # Saved to a temporary file in the same directory first and then moved into place, so an interrupted
+        # or failed save never leaves a broken copy behind under the real name
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(os.path.abspath(cache_path)))
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, ops=ops, addrs=addrs)
+            # mkstemp makes the file owner-only, so it gets the usual permissions (following the umask) before
+            # it is moved into place, the umask can only be read by setting it, so it is put straight back
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass                                                        # Not fatal, we just parse again next time
+        finally:
+            # Only still there if the save didn't make it into place
+            if tmp_path is not None and os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+    return ops, addrs
+
+
+"""The simulation kernels: these are compiled to native code by numba (if installed), so every piece of state is a
+typed numpy array or integer. The trace comes in already decoded (see decode_addresses), and the arrays are the
+cache arrays (same layout as the Cache class), updated in place. There is one kernel per kind of placement so the
+common cases don't pay for the general one:
+- Direct mapped: one way per set, so a hit is a single tag compare and the replaced block is always that way
+- Set associative: compare against the ways of the set, LRU replacement within the set (with fixed 2-way and
+  4-way versions)
+- Fully associative: there is only one set, so the set index is dropped, and with up to thousands of ways the hit
+  check and the LRU block come from a tag -> way dict and a linked list of the ways instead of scanning them
+The write policy never changes which accesses hit or which block gets replaced, only the bytes written to memory,
+so each kernel simulates both policies in the same pass over the trace: the dirty bits give the write-back
+traffic, and write-through is 4 bytes per write.
+All of them return (total_hits, bytes_to_cache, bytes_to_memory_wb, bytes_to_memory_wt, total_requests)"""
+@njit(cache=True, fastmath=False, boundscheck=False)
+def _sim_dm(ops, tags, sets, valid, dirty, tag, block_size):
+    total_hits = 0
+    bytes_to_cache = 0
+    bytes_to_memory_wb = 0
+    bytes_to_memory_wt = 0
+
+    for i in range(tags.shape[0]):
+        set_index = sets[i]
+        t = tags[i]
+        write = ops[i] == 1                                             # Cache.Operation.Write
+        if write:
+            bytes_to_memory_wt += 4                                     # Write-through goes to memory now
+
+        # Hit check is one compare, there is no LRU to keep track of with a single way
+        if valid[set_index] and tag[set_index] == t:
+            total_hits += 1
+            if write:
+                dirty[set_index] = True                                 # In write-back, just mark as dirty
+            continue
+
+        # Cache miss: need to load from memory, the only block in the set gets replaced
+        bytes_to_cache += block_size
+        if valid[set_index] and dirty[set_index]:
+            bytes_to_memory_wb += block_size                            # Dirty block written back to memory
+
+        valid[set_index] = True
+        tag[set_index] = t
+        dirty[set_index] = write
+
+    return total_hits, bytes_to_cache, bytes_to_memory_wb, bytes_to_memory_wt, tags.shape[0]
+
+
+# The set associative kernel is also inlined into fixed-way versions (below), where num_ways is a compile-time
+# constant so the way loops can be fully unrolled
+@njit(cache=True, fastmath=False, boundscheck=False, inline='always')
+def _sim_setassoc(ops, tags, sets, valid, dirty, tag, lru, block_size, num_ways):
+    total_hits = 0
+    bytes_to_cache = 0
+    bytes_to_memory_wb = 0
+    bytes_to_memory_wt = 0
+
+    for i in range(tags.shape[0]):
+        set_index = sets[i]
+        t = tags[i]
+        write = ops[i] == 1                                             # Cache.Operation.Write
+        if write:
+            bytes_to_memory_wt += 4                                     # Write-through goes to memory now
+
+        # Check if we have a hit
+        hit_way = -1
+        for w in range(num_ways):
+            if valid[set_index, w] and tag[set_index, w] == t:
+                hit_way = w
+                break
+
+        if hit_way >= 0:
+            total_hits += 1
+            lru[set_index, hit_way] = i + 1                             # Access count is the trace position
+            if write:
+                dirty[set_index, hit_way] = True                        # In write-back, just mark as dirty
+            continue
+
+        # Cache miss: need to load from memory and find the block to replace. Invalid blocks have lru == 0 (cold
+        # cache) and valid ones at least 1, so the smallest lru (first one on ties, same as np.argmin) takes
+        # invalid blocks first and then the LRU block. With only 2 or 4 ways a plain indexed loop beats building
+        # a row view for np.argmin on every miss
+        bytes_to_cache += block_size
+        way = 0
+        for w in range(1, num_ways):
+            if lru[set_index, w] < lru[set_index, way]:
+                way = w
+
+        # If dirty block is being replaced (write-back), write it to memory
+        if valid[set_index, way] and dirty[set_index, way]:
+            bytes_to_memory_wb += block_size
+
+        # Update block values
+        valid[set_index, way] = True
+        tag[set_index, way] = t
+        lru[set_index, way] = i + 1
+        dirty[set_index, way] = write
+
+    return total_hits, bytes_to_cache, bytes_to_memory_wb, bytes_to_memory_wt, tags.shape[0]
+
+
+@njit(cache=True, fastmath=False, boundscheck=False)
+def _sim_2w(ops, tags, sets, valid, dirty, tag, lru, block_size):
+    return _sim_setassoc(ops, tags, sets, valid, dirty, tag, lru, block_size, 2)
+
+
+@njit(cache=True, fastmath=False, boundscheck=False)
+def _sim_4w(ops, tags, sets, valid, dirty, tag, lru, block_size):
+    return _sim_setassoc(ops, tags, sets, valid, dirty, tag, lru, block_size, 4)
+
+
+@njit(cache=True, fastmath=False, boundscheck=False)
+def _sim_fa(ops, tags, dirty, tag, prev_way, next_way, block_size, num_ways):
+    total_hits = 0
+    bytes_to_cache = 0
+    bytes_to_memory_wb = 0
+    bytes_to_memory_wt = 0
+
+    # With thousands of ways, scanning every way for a hit (and again for the LRU block on a miss) is the most
+    # expensive part of the whole sweep, so this kernel keeps a dict from tag to way for the hit check and keeps the
+    # ways in a doubly linked list ordered from most (head) to least (tail) recently used, both O(1) per access
+    where = dict()                                                      # tag -> way holding that block
+    head = -1
+    tail = -1
+    filled = 0                                                          # Ways used so far (cold cache)
+
+    for i in range(tags.shape[0]):
+        t = tags[i]
+        write = ops[i] == 1                                             # Cache.Operation.Write
+        if write:
+            bytes_to_memory_wt += 4                                     # Write-through goes to memory now
+
+        # Check if we have a hit (any way can hold the block)
+        if t in where:
+            way = where[t]
+            total_hits += 1
+            if write:
+                dirty[way] = True                                       # In write-back, just mark as dirty
+
+            # Move the block to the front of the list (most recently used)
+            if way != head:
+                p = prev_way[way]
+                n = next_way[way]
+                next_way[p] = n
+                if n >= 0:
+                    prev_way[n] = p
+                else:
+                    tail = p
+                prev_way[way] = -1
+                next_way[way] = head
+                prev_way[head] = way
+                head = way
+            continue
+
+        # Cache miss: empty ways are used first (in order), after that the LRU block at the tail gets replaced
+        bytes_to_cache += block_size
+        if filled < num_ways:
+            way = filled
+            filled += 1
+        else:
+            way = tail
+            if dirty[way]:
+                bytes_to_memory_wb += block_size                        # Dirty block written back to memory
+            del where[tag[way]]
+            tail = prev_way[way]
+            if tail >= 0:
+                next_way[tail] = -1
+            else:
+                head = -1
+
+        tag[way] = t
+        dirty[way] = write
+        where[t] = way
+
+        # The new block goes at the front of the list
+        prev_way[way] = -1
+        next_way[way] = head
+        if head >= 0:
+            prev_way[head] = way
+        else:
+            tail = way
+        head = way
+
+    return total_hits, bytes_to_cache, bytes_to_memory_wb, bytes_to_memory_wt, tags.shape[0]
+
+
+"""Splits every address of the trace into its tag and set index, as one numpy pass over the trace. This only
+depends on (offset_bits, set_bits), so configurations with the same pair can share the result. With no set bits
+there is only one set, so no set indexes are computed at all (sets is None)"""
+def decode_addresses(addrs, offset_bits, set_bits):
+    tags = (addrs >> np.uint64(offset_bits + set_bits)).astype(np.int64)
+    if set_bits == 0:
+        return tags, None
+    sets = ((addrs >> np.uint64(offset_bits)) & np.uint64((1 << set_bits) - 1)).astype(np.int64)
+    return tags, sets
+
+
+"""Simulates a single cache geometry over the (decoded) trace, this just sets up the (cold) cache arrays and hands
+everything to the matching kernel above. Both write policies come out of the one run, the result is indexed by
+Cache.WritePolicy and each entry is (total_requests, total_hits, bytes_to_cache, bytes_to_memory)"""
+def simulate_config_vectorized(ops, tags, sets, block_size, num_ways, num_sets):
+    # Cache state, one row per set and one column per way (cold to start)
+    dirty = np.zeros((num_sets, num_ways), dtype=bool)
+    tag = np.zeros((num_sets, num_ways), dtype=np.int64)
+
+    # Dispatch to the kernel for this kind of placement (the 1-D kernels get flattened views of the arrays)
+    if num_ways == 1:
+        valid = np.zeros(num_sets, dtype=bool)
+        if sets is None:
+            sets = np.zeros(tags.shape[0], dtype=np.int64)              # Cache of a single block (one set)
+        total_hits, bytes_to_cache, bytes_to_memory_wb, bytes_to_memory_wt, total_requests = _sim_dm(
+            ops, tags, sets, valid, dirty.ravel(), tag.ravel(), block_size)
+    elif num_sets == 1:
+        # The fully associative kernel tracks which ways are in use itself, and keeps the LRU order as a linked
+        # list of ways instead of access counts
+        prev_way = np.full(num_ways, -1, dtype=np.int64)
+        next_way = np.full(num_ways, -1, dtype=np.int64)
+        total_hits, bytes_to_cache, bytes_to_memory_wb, bytes_to_memory_wt, total_requests = _sim_fa(
+            ops, tags, dirty.ravel(), tag.ravel(), prev_way, next_way, block_size, num_ways)
+    else:
+        valid = np.zeros((num_sets, num_ways), dtype=bool)
+        lru = np.zeros((num_sets, num_ways), dtype=np.int64)
+        if num_ways == 2:
+            total_hits, bytes_to_cache, bytes_to_memory_wb, bytes_to_memory_wt, total_requests = _sim_2w(
+                ops, tags, sets, valid, dirty, tag, lru, block_size)
+        elif num_ways == 4:
+            total_hits, bytes_to_cache, bytes_to_memory_wb, bytes_to_memory_wt, total_requests = _sim_4w(
+                ops, tags, sets, valid, dirty, tag, lru, block_size)
+        else:
+            total_hits, bytes_to_cache, bytes_to_memory_wb, bytes_to_memory_wt, total_requests = _sim_setassoc(
+                ops, tags, sets, valid, dirty, tag, lru, block_size, num_ways)
+
+    stats = [None, None]
+    stats[Cache.WritePolicy.WB] = (total_requests, total_hits, bytes_to_cache, bytes_to_memory_wb)
+    stats[Cache.WritePolicy.WT] = (total_requests, total_hits, bytes_to_cache, bytes_to_memory_wt)
+    return stats
+
+
+"""Each configuration is independent of the others, so the sweep is spread over a pool of worker processes. The
+trace arrays are handed to each worker once (at startup) and kept as module-level globals, rather than being sent
+along with every one of the configurations"""
+_trace_ops = None
+_trace_addrs = None
+_decoded_key = None                         # (offset_bits, set_bits) of the decoded trace below
+_decoded = None                             # (tags, sets) of the worker's trace
+
+def _init_worker(ops, addrs):
+    global _trace_ops, _trace_addrs
+    _trace_ops = ops
+    _trace_addrs = addrs
+    _clear_decoded()
+
+# The decoded trace is 16 bytes per access, so a worker only ever keeps the most recent (offset_bits, set_bits)
+# pair. The configurations are handed out grouped by that pair (see simulate_trace), so each pair is still decoded
+# only once, and dropped as soon as its group is done
+def _get_decoded(offset_bits, set_bits):
+    global _decoded_key, _decoded
+    key = (offset_bits, set_bits)
+    if key != _decoded_key:
+        _decoded = None                                                 # Free the old arrays before decoding
+        _decoded = decode_addresses(_trace_addrs, offset_bits, set_bits)
+        _decoded_key = key
+    return _decoded
+
+def _clear_decoded():
+    global _decoded_key, _decoded
+    _decoded_key = None
+    _decoded = None
+
+# Simulates one cache geometry against the worker's trace, returns the result line for each of the write policies
+# (in the same order, invalid configurations are skipped)
+def simulate_one_config(cache_size, block_size, placement, write_policies):
+    stats = None
+    results = []
+    for write_policy in write_policies:
+        # Initialize cache
+        try:
+            # self, cache_size, block_size, write_policy, placement_type):
+            cache = Cache(cache_size, block_size, write_policy, placement)
+        except RuntimeError as e:   # This should not be called to, only if we really screw up above
+            print(f"Skipping invalid configuration: {cache_size} {block_size} {placement} {write_policy} - {e}")
+            continue
+        
+        # Process trace with the array kernel (once for all of the write policies), the cache object only holds
+        # the statistics
+        if stats is None:
+            tags, sets = _get_decoded(cache.offset_bits, cache.set_bits)
+            stats = simulate_config_vectorized(_trace_ops, tags, sets, cache.block_size, cache.num_ways,
+                                               cache.num_sets)
+        (cache.total_requests, cache.total_hits,
+         cache.bytes_to_cache, cache.bytes_to_memory) = stats[cache.write_policy]
+        
+        results.append((cache.get_result_str(), cache.get_result_record()))
     
-    return operations                                                   # Returns the list of operations
+    return results
+
+# Simulates one group of configurations that share (offset_bits, set_bits), as (index, config) pairs, returns the
+# results of each configuration with its index (Pool.imap only passes a single argument)
+def _simulate_config_group(group):
+    try:
+        return [(index, simulate_one_config(*config)) for index, config in group]
+    finally:
+        _clear_decoded()
+
+# The (offset_bits, set_bits) pair a configuration decodes the trace with (None for an invalid configuration, which
+# simulate_one_config reports and skips)
+def _config_decode_key(cache_size, block_size, placement, write_policies):
+    try:
+        cache = Cache(cache_size, block_size, write_policies[0], placement)
+    except RuntimeError:
+        return None
+    return cache.offset_bits, cache.set_bits
 
 
 def simulate_trace(trace_file, output_file):
@@ -357,38 +823,42 @@ def simulate_trace(trace_file, output_file):
     ]
     
     # Read trace file
-    operations = read_trace_file(trace_file)                            # Calls to above and will need for results
-    results = []
+    ops, addrs = read_trace_file(trace_file)                            # Calls to above and will need for results
     
-    # Simulate all configurations from the structs above
-    for cache_size in cache_sizes:
-        for block_size in block_sizes:
-            for placement in placement_types:
-                for write_policy in write_policies:
-                    # Initialize cache
-                    try:
-                        # self, cache_size, block_size, write_policy, placement_type):
-                        cache = Cache(cache_size, block_size, write_policy, placement)
-                    except RuntimeError as e:   # This should not be called to, only if we really screw up above
-                        print(f"Skipping invalid configuration: {cache_size} {block_size} {placement} {write_policy} - {e}")
-                        continue
-                    
-                    # Process trace, note we infer that the op type is first, then address (i.e. read 0x00000)
-                    for op_type, address in operations:
-                        if op_type.lower() == "read" or op_type.lower() == "load":
-                            
-                            cache.read(address)
-                            # print(f"HITS: {cache.total_hits}")
-                        elif op_type.lower() == "write" or op_type.lower() == "store":
-                            cache.write(address)
-                    
-                    # Record result
-                    results.append(cache.get_result_str())
-                    
-    # Write results to output file
-    with open(output_file, 'w') as f:
-        for result in results:
-            f.write(result + '\n')
+    # All cache geometries from the structs above, in the output order (each one covers all write policies)
+    configs = [(cache_size, block_size, placement, write_policies)
+               for cache_size in cache_sizes
+               for block_size in block_sizes
+               for placement in placement_types]
+    
+    # Configurations that decode the trace the same way are grouped into one task, so a worker decodes each pair
+    # once and only holds one decoded trace at a time
+    groups = {}
+    for index, config in enumerate(configs):
+        groups.setdefault(_config_decode_key(*config), []).append((index, config))
+    
+    # Simulate all groups in parallel, and write the results to the output file as they come in. Groups finish in
+    # any order, so results that are ahead of the file wait in pending, and every time one comes in the run of
+    # configurations from the next unwritten one is written out (the file stays in the usual order of configs)
+    # (groups were built in config order, so the earliest configurations are handed out first)
+    records = []
+    pending = {}                                                        # Config index -> results not written yet
+    next_index = 0
+    with open(output_file, 'w') as f, Pool(cpu_count(), initializer=_init_worker, initargs=(ops, addrs)) as pool:
+        for group_results in pool.imap_unordered(_simulate_config_group, groups.values()):
+            pending.update(group_results)
+            while next_index in pending:
+                for result, record in pending.pop(next_index):
+                    f.write(result + '\n')
+                    records.append(record)
+                next_index += 1
+    
+    # The same results are also saved as a binary array next to the result file (RESULT_NAME.result.npy), so
+    # they can be loaded back without parsing the text (see parse_results in run_analysis.py)
+    try:
+        np.save(output_file + '.npy', np.array(records, dtype=RESULT_DTYPE))
+    except OSError:
+        pass                                                            # Not fatal, the text results are there
 
 
 def analyze_block_size_effect(result_file, cache_size, placement, write_policy, miss):
@@ -11,79 +11,133 @@
 #               Set index is very important, and I failed to realize this at 2 am
 # --------------------------------------------------------------------------------------------------------------
 
+import os
 import numpy as np
 
+# Lookup table of the ASCII hex digits, and the bit shifts of the 8 nibbles of a 32-bit address (MSB first)
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+_NIBBLE_SHIFTS = np.arange(28, -4, -4)
+
+"""Copies the addresses of one phase (and its operation) into the preallocated trace arrays at pos, returns the end."""
+def add_phase(ops, addrs, pos, op, phase_addrs):
+    end = pos + len(phase_addrs)
+    ops[pos:end] = op
+    addrs[pos:end] = phase_addrs
+    return end
+
+"""Formats the whole trace (arrays of operations and addresses) into the bytes of its trace lines."""
+def format_trace(ops, addrs):
+    # Every line is built as one fixed-width row "<op padded to 5> <8 hex digits>\n" of a single byte array,
+    # the hex digits are looked up from the nibbles of each address directly. The 'S5' ops are NUL padded,
+    # so dropping the NUL bytes afterwards leaves exactly the variable width lines
+    rows = np.empty((len(addrs), 15), dtype=np.uint8)
+    rows[:, :5] = ops.view(np.uint8).reshape(-1, 5)
+    rows[:, 5] = ord(" ")
+    rows[:, 6:14] = _HEX_DIGITS[(addrs[:, None] >> _NIBBLE_SHIFTS) & 0xF]
+    rows[:, 14] = ord("\n")
+    rows = rows.ravel()
+    return rows[rows != 0].tobytes()
+
+"""Yields the formatted bytes of the trace a chunk of lines at a time (for writelines to consume)."""
+def iter_trace_chunks(ops, addrs, chunk_lines=1 << 16):
+    # Only one chunk of formatted lines is held at once, instead of the formatted bytes of the entire trace
+    for start in range(0, len(addrs), chunk_lines):
+        yield format_trace(ops[start:start + chunk_lines], addrs[start:start + chunk_lines])
+
+"""Writes the trace to the given file, straight to the file descriptor (no buffered file object in between)."""
+def write_trace(filename, ops, addrs):
+    # Each chunk is already one big bytes object, so it is handed to os.write directly. os.write can write
+    # less than it was given, so it's called again on the rest of the chunk until everything is written
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        for chunk in iter_trace_chunks(ops, addrs):
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
 """Generate the sample associativity relationship trace that the project spec wants."""
 def create_associativity_trace(filename="associative.trace"):
-    with open(filename, 'w') as f:
-        # Calculate parameters for a 1KB cache with 8-byte blocks (the chosen setup for this trace)
-        cache_size = 1024
-        block_size = 8
-        total_blocks = cache_size // block_size  # 128 blocks
-        
-        # Phase 1: Create conflict misses for direct-mapped cache, since we want to show an INCREASE
-        # in hit rate for increased associativity.
-        for i in range(50):
-            for way in range(4):
-                addr = (way * total_blocks + (i % 16)) * block_size
-                f.write(f"read {addr:08x}\n")
+    # Each phase computes all of its addresses at once as numpy arrays (i = iteration, same loops as before just
+    # flattened) into one preallocated trace (the phase sizes are fixed), the lines are written in one go at the end
+    addrs = np.empty(50 * 4 + 50 + 50 * 2 + 50, dtype=np.uint32)
+    ops = np.empty(len(addrs), dtype='S5')
+    pos = 0
+    
+    # Calculate parameters for a 1KB cache with 8-byte blocks (the chosen setup for this trace)
+    cache_size = 1024
+    block_size = 8
+    total_blocks = cache_size // block_size  # 128 blocks
+    
+    # Phase 1: Create conflict misses for direct-mapped cache, since we want to show an INCREASE
+    # in hit rate for increased associativity. (4 ways for each of 50 iterations)
+    i = np.repeat(np.arange(50), 4)
+    way = np.tile(np.arange(4), 50)
+    addr = (way * total_blocks + (i % 16)) * block_size
+    pos = add_phase(ops, addrs, pos, "read", addr)
+    
+    # Phase 2: Working set with high temporal locality but poor spatial locality
+    i = np.arange(50)
+    way = i % 4
+    set_index = (i // 4) % 32  # 32 different sets
+    addr = (way * total_blocks + set_index) * block_size
+    pos = add_phase(ops, addrs, pos, "read", addr)
         
-        # Phase 2: Working set with high temporal locality but poor spatial locality
-        for i in range(50):
-            way = i % 4
-            set_index = (i // 4) % 32  # 32 different sets
-            addr = (way * total_blocks + set_index) * block_size
-            f.write(f"read {addr:08x}\n")
-            
-        # Phase 3: Alternating access to conflicting addresses
-        for i in range(50):
-            ways = [0, 1] if i % 2 == 0 else [2, 3]
-            for way in ways:
-                set_index = i % 32
-                addr = (way * total_blocks + set_index) * block_size
-                f.write(f"read {addr:08x}\n")
-        
-        # Phase 4: Add some write operations since we should cover those too
-        for i in range(50):
-            way = i % 4
-            set_index = i % 16
-            addr = (way * total_blocks + set_index) * block_size
-            f.write(f"write {addr:08x}\n")
+    # Phase 3: Alternating access to conflicting addresses (ways 0, 1 on even iterations, 2, 3 on odd ones)
+    i = np.repeat(np.arange(50), 2)
+    way = np.tile(np.arange(2), 50) + 2 * (i % 2)
+    set_index = i % 32
+    addr = (way * total_blocks + set_index) * block_size
+    pos = add_phase(ops, addrs, pos, "read", addr)
+    
+    # Phase 4: Add some write operations since we should cover those too
+    i = np.arange(50)
+    way = i % 4
+    set_index = i % 16
+    addr = (way * total_blocks + set_index) * block_size
+    pos = add_phase(ops, addrs, pos, "write", addr)
+    
+    write_trace(filename, ops, addrs)
 
 """Generate a block trace that creates the "bowl" shape we wanted from the report."""
 def create_block_size_trace(filename="block.trace"):
-    with open(filename, 'w') as f:
-        # Phase 1: Good spatial locality for small blocks (i.e. 4 and 8)
-        for base in range(0, 60, 8):                    # Addresses are 8 bytes apart
-            for offset in range(0, 8, 4):               # Offset in the range of 0-8 bytes
-                addr = base + offset
-                f.write(f"read {addr:08x}\n")
+    # Same as above, each phase is computed as arrays into one preallocated trace and the lines are written at the end
+    addrs = np.empty(16 + 50 + 10 + 30 + 30, dtype=np.uint32)
+    ops = np.empty(len(addrs), dtype='S5')
+    pos = 0
+    
+    # Phase 1: Good spatial locality for small blocks (i.e. 4 and 8)
+    base = np.repeat(np.arange(0, 60, 8), 2)        # Addresses are 8 bytes apart
+    offset = np.tile(np.arange(0, 8, 4), len(base) // 2)  # Offset in the range of 0-8 bytes
+    addr = base + offset
+    pos = add_phase(ops, addrs, pos, "read", addr)
+    
+    # Phase 2: High temporal locality but poor spatial locality
+    # This pattern benefits small blocks since large blocks waste space in this case (stride, working set)
+    # Create a working set with specific strides that benefit small blocks
+    i = np.arange(50)
+    addr = (i % 16) * 2 + ((i // 32) % 32) * 512
+    pos = add_phase(ops, addrs, pos, "read", addr)
         
-        # Phase 2: High temporal locality but poor spatial locality
-        # This pattern benefits small blocks since large blocks waste space in this case (stride, working set)
-        for i in range(50):
-            # Create a working set with specific strides that benefit small blocks
-            addr = (i % 16) * 2 + ((i // 32) % 32) * 512
-            f.write(f"read {addr:08x}\n")
-            
-        # Phase 3: Create a lot of conflicts for large blocks due to mapping to same set
-        for i in range(10):
-            # Create a pattern that maps to the same set for larger blocks
-            set_index = i % 4  # Only 2 sets, increasing conflicts for larger blocks
-            addr = set_index * 512 + (i % 64) * 512     # Large stride to create cache pollution
-            f.write(f"read {addr:08x}\n")
+    # Phase 3: Create a lot of conflicts for large blocks due to mapping to same set
+    # Create a pattern that maps to the same set for larger blocks
+    i = np.arange(10)
+    set_index = i % 4  # Only 2 sets, increasing conflicts for larger blocks
+    addr = set_index * 512 + (i % 64) * 512     # Large stride to create cache pollution
+    pos = add_phase(ops, addrs, pos, "read", addr)
 
-        # Phase 4: Access pattern with changing set indices for smaller block sizes
-        block_size = 32
-        for i in range(30):
-            addr = i * block_size * 129  # Spread accesses across different sets
-            f.write(f"load {addr:08x}\n")
-        
-        # Phase 5: Repeat the same addresses to demonstrate hits for smaller blocks
-        # use write instead of load, though it really doesn't matter in this case
-        for i in range(30):
-            addr = i * block_size * 129
-            f.write(f"store {addr:08x}\n")
+    # Phase 4: Access pattern with changing set indices for smaller block sizes
+    block_size = 32
+    i = np.arange(30)
+    addr = i * block_size * 129  # Spread accesses across different sets
+    pos = add_phase(ops, addrs, pos, "load", addr)
+    
+    # Phase 5: Repeat the same addresses to demonstrate hits for smaller blocks
+    # use write instead of load, though it really doesn't matter in this case
+    pos = add_phase(ops, addrs, pos, "store", addr)
+    
+    write_trace(filename, ops, addrs)
 
 """Define the main sequence when calling to this program via terminal."""
 if __name__ == "__main__":
@@ -8,156 +8,211 @@
 #               to identify the path and filenames of the output files.
 # --------------------------------------------------------------------------------------------------------------
 
-import subprocess
+import hashlib
+import inspect
+import os
+import matplotlib
+matplotlib.use("Agg")        # Non-interactive backend, the plots are only ever saved to files (see note above)
 import matplotlib.pyplot as plt
 import numpy as np
+from numpy.polynomial import chebyshev
+from numpy.polynomial.polyutils import mapdomain
+from cycler import cycler
+from cachesim import simulate_trace, RESULT_DTYPE
+import generate_trace
 from generate_trace import create_block_size_trace, create_associativity_trace
 
-def parse_results(result_file):
-    """Parse the results file from the cache simulator."""
-    results = []
-    try:
-        with open(result_file, 'r') as f:
-            for line in f:
-                parts = line.strip().split()
-                if len(parts) >= 10:
-                    result = {
-                        'cache_size': int(parts[0]),
-                        'block_size': int(parts[1]),
-                        'placement': parts[2],
-                        'ways': int(parts[3]),
-                        'write_policy': parts[4],
-                        'requests': int(parts[5]),
-                        'hits': int(parts[6]),
-                        'hit_rate': float(parts[7]),
-                        'bytes_to_cache': int(parts[8]),
-                        'bytes_to_memory': int(parts[9])
-                    }
-                    result['miss_rate'] = 1.0 - result['hit_rate']
+# One figure/axes pair is created up front and reused (cleared) by every plot below instead of building a new
+# figure per plot, each plot just resizes it to its own dimensions
+_FIG, _AX = plt.subplots(figsize=(12, 7))
 
-                    results.append(result)
-    except Exception as e:
-        print(f"Error parsing results: {e}")
+def parse_results(result_file):
+    """Parse the results file from the cache simulator into a dict of numpy arrays (one array per column)."""
+    arr = None
     
+    # The simulator also saves the results as a binary array (RESULT_NAME.result.npy), which is just memory-mapped
+    # instead of parsed, as long as it is at least as new as the text results (and has the current layout)
+    npy_file = result_file + '.npy'
+    try:
+        if os.path.getmtime(npy_file) >= os.path.getmtime(result_file):
+            arr = np.load(npy_file, mmap_mode='r')
+            if arr.dtype != RESULT_DTYPE:
+                arr = None
+    except (OSError, ValueError):
+        pass        # No (usable) binary copy, so parse the text below
+    
+    if arr is None:
+        try:
+            # Whole file is parsed in one call, lines with the wrong number of columns are skipped
+            arr = np.atleast_1d(np.genfromtxt(result_file, dtype=RESULT_DTYPE, invalid_raise=False))
+        except Exception as e:
+            print(f"Error parsing results: {e}")
+            arr = np.empty(0, dtype=RESULT_DTYPE)
+    
+    # Each column is copied out into its own contiguous array so filters only touch the column they need,
+    # the miss rate is computed for every record at once and stored alongside the parsed columns
+    results = {name: np.ascontiguousarray(arr[name]) for name in arr.dtype.names}
+    results['miss_rate'] = 1.0 - results['hit_rate']
     return results
 
-def plot_block_size_effect(results, cache_sizes=[1024, 2048, 8192, 65536], placement="DM", write_policy="WB", use_miss_rate=False):
+def plot_block_size_effect(results, cache_sizes=[1024, 2048, 8192, 65536], placement="DM", write_policy="WB", use_miss_rate=False, ax=None):
     """Plot the effect of block size on hit rate for a specific configuration."""
-    # Create plot
-    plt.figure(figsize=(12, 7))
+    # Set up the (reused) plot
+    ax = _AX if ax is None else ax
+    ax.clear()
+    ax.figure.set_size_inches(12, 7)
     
     # Define colors and markers for different cache sizes
     colors = ['blue', 'red', 'green', 'purple', 'orange', 'brown', 'pink', 'gray']
     markers = ['o', 's', '^', 'D', '*', 'x', '+', 'v']
     
     rate_label = "Miss Rate" if use_miss_rate else "Hit Rate"
-    legend_entries = []
-    
-    # Plot for each cache size
-    for i, cache_size in enumerate(cache_sizes):
-        # Filter results for the specific configuration
-        filtered = [r for r in results if r['cache_size'] == cache_size and 
-                                        r['placement'] == placement and 
-                                        r['write_policy'] == write_policy]
-        
-        if not filtered:
-            print(f"No data found for cache size {cache_size} bytes")
-            continue
-            
-        # Extract block sizes and hit/miss rates
-        block_sizes = [r['block_size'] for r in filtered]
-        rates = [r['miss_rate'] if use_miss_rate else r['hit_rate'] for r in filtered]
-        
-        # Sort by block size
-        sorted_data = sorted(zip(block_sizes, rates))
-        if sorted_data:  # Check if we have data
-            block_sizes_sorted, rates_sorted = zip(*sorted_data)
-            
-            # Plot this cache size
-            color = colors[i % len(colors)]
-            marker = markers[i % len(markers)]
-            cache_size_label = f"{cache_size//1024}KB" if cache_size >= 1024 else f"{cache_size}B"
-            line = plt.plot(block_sizes_sorted, rates_sorted, marker=marker, 
-                           linestyle='-', linewidth=2, markersize=8, 
-                           color=color, label=f"Cache Size: {cache_size_label}")
-            legend_entries.append(line[0])
-            
-            # Add a polynomial fit to visualize the trend better
-            if len(block_sizes_sorted) > 2:
-                try:
-                    x_smooth = np.logspace(np.log2(min(block_sizes_sorted)), np.log2(max(block_sizes_sorted)), 100, base=2)
-                    coeffs = np.polyfit(np.log2(block_sizes_sorted), rates_sorted, 2)
-                    poly = np.poly1d(coeffs)
-                    y_smooth = poly(np.log2(x_smooth))
-                    plt.plot(x_smooth, y_smooth, '--', color=color, linewidth=1, alpha=0.7)
-                except:
-                    pass
+    
+    # Filter results for the specific configuration (all the requested cache sizes at once)
+    mask = (np.isin(results['cache_size'], cache_sizes) & 
+            (results['placement'] == placement) & 
+            (results['write_policy'] == write_policy))
+    sizes = results['cache_size'][mask]
+    block_sizes = results['block_size'][mask]
+    rates = results['miss_rate' if use_miss_rate else 'hit_rate'][mask]
+    
+    # Only cache sizes with data get a line, each keeps the color/marker of its position in cache_sizes
+    cache_sizes = np.asarray(cache_sizes)
+    present = np.isin(cache_sizes, sizes)
+    for cache_size in cache_sizes[~present]:
+        print(f"No data found for cache size {cache_size} bytes")
+    series = np.flatnonzero(present)
+    
+    # Group into one row per plotted cache size and one column per (sorted) block size, so every line is drawn
+    # by a single plot call. Block sizes that a cache size has no result for stay NaN (a gap in its line)
+    # (rows are found the same way as the placement order below, cache_sizes doesn't have to be sorted)
+    x = np.unique(block_sizes)
+    sorter = np.argsort(cache_sizes[series])
+    row = sorter[np.searchsorted(cache_sizes[series], sizes, sorter=sorter)]
+    grid = np.full((series.size, x.size), np.nan)
+    grid[row, np.searchsorted(x, block_sizes)] = rates
+    
+    # Colors/markers come from a property cycle set up once for the plotted series (taken by their position
+    # in cache_sizes, wrapping around like the lists above)
+    series_colors = np.take(colors, series, mode='wrap')
+    labels = [f"Cache Size: {s//1024}KB" if s >= 1024 else f"Cache Size: {s}B" for s in cache_sizes[series]]
+    if series.size:
+        ax.set_prop_cycle(cycler(color=series_colors) + cycler(marker=np.take(markers, series, mode='wrap')))
+        ax.plot(x, grid.T, linestyle='-', linewidth=2, markersize=8, label=labels)
+    
+    # Add a polynomial fit to visualize the trend better
+    # (the 100 point trend curves are rasterized, so saving to a vector format doesn't draw them as big paths,
+    # the data lines/markers stay vectors)
+    # The quadratic is fitted in log2 space with a Chebyshev basis, with the log block sizes mapped onto [-1, 1]
+    # (the basis is well conditioned there). The logs of the block sizes and the smooth samples between the
+    # smallest and largest block size are computed once and shared by all the series
+    lx = np.log2(x)
+    lx_smooth = np.linspace(lx[0], lx[-1], 100) if x.size else lx
+    x_smooth = 2.0 ** lx_smooth
+    
+    # Series that have every block size are all fitted with one call (one column per series)
+    complete = ~np.isnan(grid).any(axis=1)
+    if x.size > 2 and complete.any():
+        t = mapdomain(lx, lx[[0, -1]], [-1, 1])
+        coeffs = chebyshev.chebfit(t, grid[complete].T, 2)
+        ax.set_prop_cycle(cycler(color=series_colors[complete]))        # Same colors, but without the markers
+        ax.plot(x_smooth, chebyshev.chebval(np.linspace(-1, 1, 100), coeffs).T, '--', linewidth=1, alpha=0.7, 
+                rasterized=True)
+    
+    # Any series with gaps is fitted on its own points (and only over its own range of block sizes)
+    for rates_row, color in zip(grid[~complete], series_colors[~complete]):
+        valid = ~np.isnan(rates_row)
+        if np.count_nonzero(valid) > 2:
+            lx_valid = lx[valid]
+            coeffs = chebyshev.chebfit(mapdomain(lx_valid, lx_valid[[0, -1]], [-1, 1]), rates_row[valid], 2)
+            ax.plot(2.0 ** np.linspace(lx_valid[0], lx_valid[-1], 100),
+                    chebyshev.chebval(np.linspace(-1, 1, 100), coeffs),
+                    '--', color=color, linewidth=1, alpha=0.7, rasterized=True)
     
     # Finalize the plot
-    plt.xscale('log', base=2)
-    plt.xlabel("Block Size (Bytes)")
-    plt.ylabel(rate_label)
-    plt.title(f"Effect of Block Size on {rate_label}\n(Placement: {placement}, Write Policy: {write_policy})")
-    plt.grid(True)
-    plt.legend()
+    ax.set_xscale('log', base=2)
+    ax.set_xlabel("Block Size (Bytes)")
+    ax.set_ylabel(rate_label)
+    ax.set_title(f"Effect of Block Size on {rate_label}\n(Placement: {placement}, Write Policy: {write_policy})")
+    ax.grid(True)
+    ax.legend()
     
     filename = f"block_size_effect.png"
-    plt.savefig(filename)
-    plt.show()
-    plt.close()
+    ax.figure.savefig(filename, dpi=100)
+    ax.clear()
     print(f"Block size effect plot saved to {filename}")
 
-def plot_associativity_effect(results, cache_size=1024, block_size=8, write_policy="WB", use_miss_rate=False):
+def plot_associativity_effect(results, cache_size=1024, block_size=8, write_policy="WB", use_miss_rate=False, ax=None):
     """Plot the effect of associativity on hit rate for a specific configuration."""
     # Filter results for the specific configuration
-    filtered = [r for r in results if r['cache_size'] == cache_size and 
-                                      r['block_size'] == block_size and 
-                                      r['write_policy'] == write_policy]
+    mask = ((results['cache_size'] == cache_size) & 
+            (results['block_size'] == block_size) & 
+            (results['write_policy'] == write_policy))
     
     # Extract associativity and hit/miss rates
-    placements = []
-    rates = []
-    for r in filtered:
-        placements.append(r['placement'])
-        rates.append(r['miss_rate'] if use_miss_rate else r['hit_rate'])
+    placements = results['placement'][mask]
+    rates = results['miss_rate' if use_miss_rate else 'hit_rate'][mask]
     
     rate_label = "Miss Rate" if use_miss_rate else "Hit Rate"
     
     # Sort by associativity (DM -> 2W -> 4W -> FA)
-    placement_order = {"DM": 0, "2W": 1, "4W": 2, "FA": 3}
-    sorted_data = sorted(zip(placements, rates), key=lambda x: placement_order[x[0]])
-    placements_sorted, rates_sorted = zip(*sorted_data)
-    
-    # Create plot
-    plt.figure(figsize=(10, 6))
-    plt.bar(range(len(placements_sorted)), rates_sorted, width=0.6)
-    plt.xticks(range(len(placements_sorted)), placements_sorted)
-    plt.xlabel("Cache Associativity")
-    plt.ylabel(rate_label)
-    plt.title(f"Effect of Associativity on {rate_label}\n(Cache Size: {cache_size} bytes, Block Size: {block_size} bytes, Write Policy: {write_policy})")
-    plt.grid(True, axis='y')
+    # The order array itself isn't alphabetical, so searchsorted gets a sorter and the result is mapped back
+    # to the position of each placement within the order array, which is the rank we sort by
+    placement_order = np.array(["DM", "2W", "4W", "FA"])
+    sorter = np.argsort(placement_order)
+    rank = sorter[np.searchsorted(placement_order, placements, sorter=sorter)]
+    idx = np.argsort(rank, kind='stable')
+    placements_sorted = placements[idx]
+    rates_sorted = rates[idx]
+    
+    # Set up the (reused) plot
+    ax = _AX if ax is None else ax
+    ax.clear()
+    ax.figure.set_size_inches(10, 6)
+    ax.bar(range(len(placements_sorted)), rates_sorted, width=0.6)
+    ax.set_xticks(range(len(placements_sorted)), placements_sorted)
+    ax.set_xlabel("Cache Associativity")
+    ax.set_ylabel(rate_label)
+    ax.set_title(f"Effect of Associativity on {rate_label}\n(Cache Size: {cache_size} bytes, Block Size: {block_size} bytes, Write Policy: {write_policy})")
+    ax.grid(True, axis='y')
     
     filename = f"associativity_effect_grouped.png"
-    plt.savefig(filename)
-    plt.show()
-    plt.close()
+    ax.figure.savefig(filename, dpi=100)
+    ax.clear()
     print(f"Associativity effect plot saved to {filename}")
 
+def generate_trace_if_changed(generator, filename):
+    """Run one of the trace generators, unless the trace file was already generated by the same code."""
+    # The traces are deterministic, so they only depend on the generator code: the source of the whole
+    # generate_trace module (generator, helpers and constants) is hashed and kept in a sidecar next to the trace
+    digest = hashlib.sha256((generator.__name__ + inspect.getsource(generate_trace)).encode()).hexdigest()
+    hash_file = filename + ".hash"
+    try:
+        with open(hash_file, 'r') as f:
+            if f.read() == digest and os.path.exists(filename):
+                return
+    except OSError:
+        pass        # No (readable) sidecar yet, so just regenerate
+    
+    generator(filename)
+    with open(hash_file, 'w') as f:
+        f.write(digest)
+
 def run_simulation(miss=False):
     """Run the cache simulator and analyze results."""
     # Generate trace files
     print("Generating trace files...")
-    create_block_size_trace("block.trace")
-    create_associativity_trace("associative.trace")
+    generate_trace_if_changed(create_block_size_trace, "block.trace")
+    generate_trace_if_changed(create_associativity_trace, "associative.trace")
     
     # Begin the simulation of the generated files (not the standard files given in the project files)
-    # Run cache simulator on block size trace
+    # The simulator is called directly in this process (no new interpreter per trace), one trace after the other
+    # since each run already spreads its configurations over every core
     print("Running cache simulator on block.trace...")
-    subprocess.run(["python", "cachesim.py", "--trace", "block.trace", "--result", "block.result"])
+    simulate_trace("block.trace", "block.result")
     
-    # Run cache simulator on associativity trace
     print("Running cache simulator on associative.trace...")
-    subprocess.run(["python", "cachesim.py", "--trace", "associative.trace", "--result", "associative.result"])
+    simulate_trace("associative.trace", "associative.result")
     
     # Now we can do some data analytics: NOTE that this is saved to a file in the repo directory
     # I didn't specify the ability for the user to see it directly during runtime because I figured that anyone